@@ -29,7 +29,7 @@ version = 1.0.0
 
 # (list) Application requirements
 # comma separated e.g. requirements = sqlite3,kivy
-requirements = python3,kivy,numpy,plyer,pillow,opencv,pyjnius
+requirements = python3,kivy,numpy,pillow,opencv,pyjnius
 
 # (str) Custom source folders for requirements
 # Sets custom source for any requirements with recipes
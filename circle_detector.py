@@ -2,37 +2,62 @@
 Circle Detector - Универсальный детектор с приоритетом на точность
 """
 
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
 
+FOUR_PI = 4.0 * math.pi
+
+
 class CircleDetector:
-    
+
+    # Фиксированные пороги бинаризации (к ним добавляется порог Otsu)
+    THRESH_LEVELS = (50, 70, 90, 110, 130)
+
+    def __init__(self):
+        # Ядро морфологии одно на все пороги и все вызовы
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        # Пороги независимы, а OpenCV отпускает GIL — считаем их параллельно
+        self._pool = ThreadPoolExecutor(max_workers=min(6, os.cpu_count() or 1))
+        # Цифры Hershey моноширинные: размер подписи зависит только от длины
+        self._text_sizes = {}
+
     def detect_circles(self, image):
+        """Возвращает (count, circles, output); circles — int32 массив (N, 3) из (x, y, r).
+        
+        При count == 0 output — это сам image, а не копия: рисовать на нём
+        значит менять входной массив.
+        """
         height, width = image.shape[:2]
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
         # Определяем зону контента
-        row_means = np.mean(gray, axis=1)
-        non_black = np.where(row_means > 20)[0]
+        row_means = cv2.reduce(gray, 1, cv2.REDUCE_AVG, dtype=cv2.CV_32F).ravel()
+        non_black = np.flatnonzero(row_means > 20)
         min_y = non_black[0] + 5 if len(non_black) > 0 else 0
         max_y = non_black[-1] - 5 if len(non_black) > 0 else height
         
         all_circles = []
-        
-        # Несколько порогов бинаризации
-        for thresh_val in [50, 70, 90, 110, 130]:
-            _, thresh = cv2.threshold(gray, thresh_val, 255, cv2.THRESH_BINARY_INV)
-            circles = self._extract_circles(thresh, min_y, max_y)
-            all_circles.extend(circles)
-        
-        # Otsu
-        _, thresh_otsu = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        circles_otsu = self._extract_circles(thresh_otsu, min_y, max_y)
-        all_circles.extend(circles_otsu)
-        
+
+        # Несколько порогов бинаризации + Otsu в одном проходе.
+        # Если уровень Otsu совпал с фиксированным — не сканируем его повторно
+        otsu_val = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[0]
+        levels = list(self.THRESH_LEVELS)
+        if otsu_val not in levels:
+            levels.append(otsu_val)
+
+        futures = [self._pool.submit(self._process_threshold, gray, thresh_val, min_y, max_y)
+                   for thresh_val in levels]
+        for f in futures:
+            all_circles.extend(f.result())
+
+        # Рисовать нечего — отдаём исходное изображение без копии
         if not all_circles:
-            return 0, [], image.copy()
+            return 0, np.empty((0, 3), dtype=np.int32), image
         
         # Удаляем дубликаты
         filtered = self._remove_duplicates(all_circles)
@@ -44,58 +69,65 @@ class CircleDetector:
             filtered = [c for c in filtered if 0.5 * median_r < c[2] < 2.0 * median_r]
         
         # Сортировка
-        circles_sorted = sorted(filtered, key=lambda c: (c[1]//15, c[0]))
+        arr = np.asarray(filtered)[:, :3].astype(np.int32)
+        order = np.lexsort((arr[:, 0], arr[:, 1] // 15))
+        result_circles = arr[order]
         
         # Рисуем
         output = image.copy()
-        result_circles = []
         
-        for i, c in enumerate(circles_sorted, 1):
-            x, y, r = c[0], c[1], c[2]
-            result_circles.append((x, y, r))
+        for i, (x, y, r) in enumerate(result_circles.tolist(), 1):
             cv2.circle(output, (x, y), r, (0, 255, 0), 2)
             cv2.circle(output, (x, y), 9, (0, 140, 255), -1)
             label = str(i)
-            (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.32, 1)
+            text_size = self._text_sizes.get(len(label))
+            if text_size is None:
+                text_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.32, 1)[0]
+                self._text_sizes[len(label)] = text_size
+            tw, th = text_size
             cv2.putText(output, label, (x - tw//2, y + th//2),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.32, (255, 255, 255), 1, cv2.LINE_AA)
         
         return len(result_circles), result_circles, output
     
+    def _process_threshold(self, gray, thresh_val, min_y, max_y):
+        _, thresh = cv2.threshold(gray, thresh_val, 255, cv2.THRESH_BINARY_INV)
+        return self._extract_circles(thresh, min_y, max_y)
+    
     def _extract_circles(self, thresh, min_y, max_y):
-        circles = []
-        
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        cleaned = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
-        cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_CLOSE, kernel)
+        # CLOSE нужен: без него слипшиеся/рваные объекты дают лишние круги
+        cleaned = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, self._kernel)
+        cv2.morphologyEx(cleaned, cv2.MORPH_CLOSE, self._kernel, dst=cleaned)
         
         contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
+        # Из OpenCV забираем только сырые признаки, фильтр считаем в NumPy
+        stats = []
         for cnt in contours:
             area = cv2.contourArea(cnt)
             if area < 80:
                 continue
-            
-            perimeter = cv2.arcLength(cnt, True)
-            if perimeter == 0:
-                continue
-            
-            circularity = 4 * np.pi * area / (perimeter ** 2)
             (x, y), radius = cv2.minEnclosingCircle(cnt)
-            
-            if y < min_y or y > max_y or radius < 5:
-                continue
-            
-            circle_area = np.pi * radius ** 2
+            stats.append((area, cv2.arcLength(cnt, True), x, y, radius))
+        
+        if not stats:
+            return []
+        
+        area, perimeter, x, y, radius = np.array(stats).T
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            circularity = FOUR_PI * area / (perimeter * perimeter)
+            circle_area = math.pi * radius * radius
             fill_ratio = area / circle_area
-            
-            # Качественный круг: хорошая круглость И заполненность
-            quality = circularity * fill_ratio
-            
-            if circularity > 0.45 and fill_ratio > 0.45:
-                circles.append((int(x), int(y), int(radius), quality))
-        
-        return circles
+        
+        # Качественный круг: хорошая круглость И заполненность
+        quality = circularity * fill_ratio
+        
+        keep = ((perimeter > 0) & (y >= min_y) & (y <= max_y) & (radius >= 5)
+                & (circularity > 0.45) & (fill_ratio > 0.45))
+        
+        return [(int(cx), int(cy), int(r), q)
+                for cx, cy, r, q in zip(x[keep], y[keep], radius[keep], quality[keep])]
     
     def _remove_duplicates(self, circles):
         if not circles:
@@ -103,14 +135,24 @@ class CircleDetector:
         
         radii = [c[2] for c in circles]
         median_r = np.median(radii)
-        min_dist = median_r * 1.2  # Уменьшили для мелких объектов
+        min_dist = float(median_r * 1.2)  # Уменьшили для мелких объектов
+        min_dist_sq = min_dist * min_dist
         
+        # Сетка с ячейкой min_dist: близкий сосед может лежать только
+        # в той же или одной из 8 соседних ячеек
+        cell = min_dist
+        grid = {}
         kept = []
         for c in sorted(circles, key=lambda x: -x[3]):
             x, y = c[0], c[1]
-            if not any(np.sqrt((x-k[0])**2 + (y-k[1])**2) < min_dist for k in kept):
-                kept.append(c)
-        
+            bx, by = int(x // cell), int(y // cell)
+            if any((x-kx)*(x-kx) + (y-ky)*(y-ky) < min_dist_sq
+                   for nx in (bx-1, bx, bx+1) for ny in (by-1, by, by+1)
+                   for kx, ky in grid.get((nx, ny), ())):
+                continue
+            grid.setdefault((bx, by), []).append((x, y))
+            kept.append(c)
+
         return kept
 
 
@@ -3,25 +3,38 @@ Circle Counter - Android приложение для подсчёта кругл
 """
 
 import os
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.label import Label
 from kivy.uix.image import Image
-from kivy.uix.popup import Popup
-from kivy.uix.filechooser import FileChooserListView
 from kivy.graphics.texture import Texture
 from kivy.clock import Clock
 from kivy.utils import platform
 from kivy.logger import Logger
 from kivy.core.window import Window
 
-import cv2
-import numpy as np
+# cv2, numpy и CircleDetector импортируются по месту: загрузка OpenCV
+# на Android занимает секунды, а UI должен появиться сразу.
+# Так же по месту — окно выбора файла, оно нужно только на десктопе
 
-from circle_detector import CircleDetector
+
+# Максимальная сторона изображения, на котором запускается детектор
+MAX_DETECT_SIDE = 1280
+
+# Масштаб шрифта номеров ручных кругов
+LABEL_FONT_SCALE = 0.32
+
+# Коды запросов для съёмки камерой и выбора фото из галереи
+CAMERA_REQUEST_CODE = 1
+GALLERY_REQUEST_CODE = 2
+
+# Куда камера пишет снимок (Android 10+) и файл в данных приложения с URI
+# этого снимка: запись удаляется и после того, как система убила процесс
+CAPTURE_RELATIVE_PATH = 'Pictures/CircleCounter'
+CAPTURE_MARKER_NAME = 'pending_capture.txt'
 
 
 class TouchableImage(Image):
@@ -43,14 +56,27 @@ class CircleCounterApp(App):
     
     def build(self):
         self.title = 'Circle Counter'
-        self.detector = CircleDetector()
+        self.detector = None  # Создаётся при первой детекции, см. _ensure_detector
         self.current_image = None
         self.result_image = None
         self.base_result_image = None  # Изображение до ручных добавлений
         self.detected_count = 0
-        self.manual_circles = []  # Список ручных кругов для отмены
+        self.manual_circles = []  # Ручные круги: (x, y, r, область, пиксели под ней)
+        self._pending_manual = []  # Тапы, ещё не нарисованные, см. _flush_manual
+        # Отрисовка тапов к следующему кадру; повторный вызов до срабатывания ничего не добавляет
+        self._flush_trigger = Clock.create_trigger(self._flush_manual)
         self.circles = []
         self.median_radius = 15
+        self._texture = None  # Переиспользуется, пока не сменится размер
+        self._busy = False  # Идёт фоновая детекция
+        self._detect_pool = ThreadPoolExecutor(max_workers=1)
+        self._gallery_bound = False  # Обработчик результата галереи уже привязан
+        self._camera_bound = False  # То же для камеры
+        self._camera_uri = None  # Куда камера пишет текущий снимок
+        self._cap = None  # VideoCapture на десктопе, открывается при первом снимке
+        self._label_sizes = {}  # Размер подписи по числу цифр
+        self._upload_buf = bytearray()  # Буфер для загрузки в текстуру, растёт по мере надобности
+        self._touch_transform = None  # (1/scale, offset_x, offset_y, img_w, img_h)
         
         Window.clearcolor = (0.1, 0.1, 0.1, 1)
         
@@ -71,6 +97,7 @@ class CircleCounterApp(App):
             keep_ratio=True
         )
         self.image_widget.app = self
+        self.image_widget.bind(size=self._recalc_transform, pos=self._recalc_transform)
         self.layout.add_widget(self.image_widget)
         
         # Подсказка
@@ -139,9 +166,25 @@ class CircleCounterApp(App):
         
         if platform == 'android':
             Clock.schedule_once(self._request_permissions, 0.5)
+            Clock.schedule_once(self._cleanup_stale_capture, 0)
         
         return self.layout
     
+    def on_stop(self):
+        self._detect_pool.shutdown(wait=False)
+        self._release_capture()
+    
+    def on_pause(self):
+        # В фоне камеру не держим: при следующем снимке она откроется заново
+        self._release_capture()
+        return True
+    
+    def _release_capture(self):
+        """Освобождение камеры на десктопе"""
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+    
     def _request_permissions(self, dt):
         try:
             from android.permissions import request_permissions, Permission
@@ -155,6 +198,54 @@ class CircleCounterApp(App):
     
     def add_manual_circle(self, touch_pos):
         """Добавление круга по тапу"""
+        if self.result_image is None or self._touch_transform is None:
+            return
+        inv_scale, offset_x, offset_y, img_w, img_h = self._touch_transform
+        
+        touch_x, touch_y = touch_pos
+        img_x = (touch_x - offset_x) * inv_scale
+        img_y = img_h - (touch_y - offset_y) * inv_scale
+        
+        if 0 <= img_x < img_w and 0 <= img_y < img_h:
+            # Рисуем не сразу, а раз в кадр: быстрые тапы уходят одной пачкой
+            # и одной загрузкой в текстуру
+            self._pending_manual.append((int(img_x), int(img_y)))
+            self._flush_trigger()
+    
+    def _flush_manual(self, dt):
+        """Отрисовка накопленных за кадр ручных кругов"""
+        self._flush_trigger.cancel()
+        pending, self._pending_manual = self._pending_manual, []
+        if not pending or self.result_image is None:
+            return
+        
+        r = self.median_radius
+        dirty = None
+        for x, y in pending:
+            total = self.detected_count + len(self.manual_circles) + 1
+            
+            # Для отмены сохраняем только область под кругом, а не весь кадр
+            region = self._manual_circle_region(x, y, r, total)
+            x0, y0, x1, y1 = region
+            patch = self.result_image[y0:y1, x0:x1].copy()
+            self.manual_circles.append((x, y, r, region, patch))
+            
+            self._draw_manual_circle(x, y, r, total)
+            if dirty is None:
+                dirty = region
+            else:
+                dirty = (min(dirty[0], x0), min(dirty[1], y0),
+                         max(dirty[2], x1), max(dirty[3], y1))
+        
+        self._update_display_region(*dirty)
+        self._update_result_text()
+    
+    def _recalc_transform(self, *args):
+        """Пересчёт перевода координат тапа в пиксели изображения.
+        
+        Вызывается при смене размера/положения виджета и нового результата,
+        чтобы не считать масштаб и отступы на каждый тап.
+        """
         if self.result_image is None:
             return
         
@@ -162,71 +253,68 @@ class CircleCounterApp(App):
         widget_x, widget_y = self.image_widget.pos
         img_h, img_w = self.result_image.shape[:2]
         
-        scale_w = widget_w / img_w
-        scale_h = widget_h / img_h
-        scale = min(scale_w, scale_h)
+        scale = min(widget_w / img_w, widget_h / img_h)
+        if scale <= 0:
+            self._touch_transform = None
+            return
         
-        displayed_w = img_w * scale
-        displayed_h = img_h * scale
+        offset_x = widget_x + (widget_w - img_w * scale) / 2
+        offset_y = widget_y + (widget_h - img_h * scale) / 2
+        self._touch_transform = (1.0 / scale, offset_x, offset_y, img_w, img_h)
+    
+    def _label_size(self, label):
+        import cv2
         
-        offset_x = widget_x + (widget_w - displayed_w) / 2
-        offset_y = widget_y + (widget_h - displayed_h) / 2
+        # Цифры Hershey моноширинные: размер зависит только от длины подписи
+        text_size = self._label_sizes.get(len(label))
+        if text_size is None:
+            text_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, LABEL_FONT_SCALE, 1)[0]
+            self._label_sizes[len(label)] = text_size
+        return text_size
+    
+    def _manual_circle_region(self, x, y, r, num):
+        """Область (x0, y0, x1, y1), которую закрасит ручной круг с номером"""
+        tw, th = self._label_size(str(num))
+        # Кольцо толщиной 2, точка радиусом 9 и подпись — с запасом в 2 px
+        half = max(r, 9, tw // 2, th // 2) + 2
+        img_h, img_w = self.result_image.shape[:2]
+        return (max(0, x - half), max(0, y - half),
+                min(img_w, x + half + 1), min(img_h, y + half + 1))
+    
+    def _draw_manual_circle(self, x, y, r, num):
+        """Рисует белый ручной круг с номером на result_image"""
+        import cv2
         
-        touch_x, touch_y = touch_pos
-        img_x = (touch_x - offset_x) / scale
-        img_y = img_h - (touch_y - offset_y) / scale
+        cv2.circle(self.result_image, (x, y), r, (255, 255, 255), 2)
+        cv2.circle(self.result_image, (x, y), 9, (255, 255, 255), -1)
         
-        if 0 <= img_x < img_w and 0 <= img_y < img_h:
-            x, y = int(img_x), int(img_y)
-            r = int(self.median_radius)
-            
-            # Сохраняем для отмены
-            self.manual_circles.append((x, y, r))
-            
-            total = self.detected_count + len(self.manual_circles)
-            
-            # Рисуем белый круг
-            cv2.circle(self.result_image, (x, y), r, (255, 255, 255), 2)
-            cv2.circle(self.result_image, (x, y), 9, (255, 255, 255), -1)
-            
-            label = str(total)
-            font_scale = 0.32
-            (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)
-            cv2.putText(self.result_image, label, (x - tw//2, y + th//2),
-                       cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 1, cv2.LINE_AA)
-            
-            self._update_display()
-            self._update_result_text()
+        label = str(num)
+        tw, th = self._label_size(label)
+        cv2.putText(self.result_image, label, (x - tw//2, y + th//2),
+                   cv2.FONT_HERSHEY_SIMPLEX, LABEL_FONT_SCALE, (0, 0, 0), 1, cv2.LINE_AA)
     
     def undo_last(self, instance):
         """Отмена последнего добавленного круга"""
+        # Тапы этого кадра тоже отменяемы
+        self._flush_manual(0)
         if not self.manual_circles or self.base_result_image is None:
             return
         
-        # Удаляем последний круг
-        self.manual_circles.pop()
+        # Круги снимаются в обратном порядке, поэтому сохранённая область —
+        # это ровно состояние до последнего круга
+        _, _, _, region, patch = self.manual_circles.pop()
+        x0, y0, x1, y1 = region
+        self.result_image[y0:y1, x0:x1] = patch
         
-        # Перерисовываем с нуля
-        self.result_image = self.base_result_image.copy()
-        
-        # Добавляем оставшиеся ручные круги
-        for i, (x, y, r) in enumerate(self.manual_circles):
-            num = self.detected_count + i + 1
-            cv2.circle(self.result_image, (x, y), r, (255, 255, 255), 2)
-            cv2.circle(self.result_image, (x, y), 9, (255, 255, 255), -1)
-            label = str(num)
-            font_scale = 0.32
-            (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)
-            cv2.putText(self.result_image, label, (x - tw//2, y + th//2),
-                       cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 1, cv2.LINE_AA)
-        
-        self._update_display()
+        self._update_display_region(*region)
         self._update_result_text()
     
     def reset_manual(self, instance):
         """Сброс всех ручных добавлений"""
         if self.base_result_image is not None:
             self.manual_circles = []
+            self._pending_manual = []
+            self._flush_trigger.cancel()
             self.result_image = self.base_result_image.copy()
             self._update_display()
             self._update_result_text()
@@ -245,85 +333,207 @@ class CircleCounterApp(App):
     def open_camera(self, instance):
         """Открытие камеры"""
         if platform == 'android':
+            uri = None
             try:
-                # Используем Intent напрямую для камеры
+                # Камера пишет снимок в полном разрешении по нашему URI,
+                # а не отдаёт уменьшенную превью-картинку в extras
                 from android import activity
-                from jnius import autoclass
+                from jnius import autoclass, cast
                 
                 Intent = autoclass('android.content.Intent')
                 MediaStore = autoclass('android.provider.MediaStore')
+                Media = autoclass('android.provider.MediaStore$Images$Media')
+                ContentValues = autoclass('android.content.ContentValues')
+                PythonActivity = autoclass('org.kivy.android.PythonActivity')
+                
+                Version = autoclass('android.os.Build$VERSION')
+                Integer = autoclass('java.lang.Integer')
+                
+                values = ContentValues()
+                values.put(Media.MIME_TYPE, 'image/jpeg')
+                if Version.SDK_INT >= 29:
+                    # Пока запись pending, другие приложения (галерея) её не видят
+                    values.put(Media.RELATIVE_PATH, CAPTURE_RELATIVE_PATH)
+                    values.put(Media.IS_PENDING, Integer(1))
+                resolver = PythonActivity.mActivity.getContentResolver()
+                uri = resolver.insert(Media.EXTERNAL_CONTENT_URI, values)
+                if uri is None:
+                    raise RuntimeError('MediaStore insert failed')
+                if Version.SDK_INT >= 29:
+                    # Без этого pending-запись не откроет и не удалит даже владелец
+                    uri = MediaStore.setIncludePending(uri)
+                self._camera_uri = uri
+                
+                # URI сохраняем на диск до запуска камеры: процесс могут убить,
+                # пока она на экране, и тогда запись удалит следующий запуск
+                with open(self._capture_marker_path(), 'w') as f:
+                    f.write(uri.toString())
                 
                 intent = Intent(MediaStore.ACTION_IMAGE_CAPTURE)
-                activity.start_activity_for_result(intent, 1)
+                intent.putExtra(MediaStore.EXTRA_OUTPUT,
+                                cast('android.os.Parcelable', uri))
+                intent.addFlags(Intent.FLAG_GRANT_WRITE_URI_PERMISSION)
                 
-                # Устанавливаем обработчик результата
-                activity.bind(on_activity_result=self._on_camera_result)
+                if not self._camera_bound:
+                    activity.bind(on_activity_result=self._on_camera_result)
+                    self._camera_bound = True
+                PythonActivity.mActivity.startActivityForResult(intent, CAMERA_REQUEST_CODE)
                 
             except Exception as e:
                 Logger.error(f"Camera Intent: {e}")
+                # Камера не запустилась (нет разрешения или приложения камеры) —
+                # пустая запись MediaStore не должна остаться в галерее
+                self._camera_uri = None
+                if uri is not None:
+                    try:
+                        self._delete_capture(uri)
+                    except Exception as e:
+                        Logger.error(f"Capture cleanup: {e}")
                 # Fallback - используем галерею
                 self.result_label.text = 'Камера недоступна. Используйте галерею.'
         else:
             # Десктоп
             try:
-                cap = cv2.VideoCapture(0)
-                ret, frame = cap.read()
-                cap.release()
+                # Камера открывается один раз: повторное открытие с прогревом
+                # экспозиции стоит сотни миллисекунд на каждый снимок
+                if self._cap is None:
+                    import cv2
+                    self._cap = cv2.VideoCapture(0)
+                    # Держим в очереди один кадр, иначе grab отдаёт снимок
+                    # из буфера драйвера, снятый при прошлом нажатии
+                    self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                    # MJPG разгружает USB; больше MAX_DETECT_SIDE всё равно не нужно
+                    self._cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+                    self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, MAX_DETECT_SIDE)
+                    self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, MAX_DETECT_SIDE * 9 // 16)
+                ret, frame = False, None
+                if self._cap.grab():
+                    ret, frame = self._cap.retrieve()
                 if ret:
-                    self.current_image = frame.copy()
+                    self.current_image = frame
                     self._process_and_display(frame)
                 else:
+                    # В следующий раз попробуем открыть камеру заново
+                    self._release_capture()
                     self.result_label.text = 'Камера недоступна'
             except Exception as e:
                 self.result_label.text = f'Ошибка: {e}'
     
     def _on_camera_result(self, request_code, result_code, intent):
         """Обработка результата камеры"""
-        if request_code == 1 and intent:
+        if request_code != CAMERA_REQUEST_CODE or self._camera_uri is None:
+            return
+        uri, self._camera_uri = self._camera_uri, None
+        try:
+            from jnius import autoclass
+            
+            Activity = autoclass('android.app.Activity')
             try:
-                from jnius import autoclass
-                
-                # Получаем bitmap из intent
-                extras = intent.getExtras()
-                if extras:
-                    bitmap = extras.get('data')
-                    if bitmap:
-                        # Конвертируем Bitmap в numpy array
-                        width = bitmap.getWidth()
-                        height = bitmap.getHeight()
-                        
-                        Bitmap = autoclass('android.graphics.Bitmap')
-                        ByteArrayOutputStream = autoclass('java.io.ByteArrayOutputStream')
-                        CompressFormat = autoclass('android.graphics.Bitmap$CompressFormat')
-                        
-                        stream = ByteArrayOutputStream()
-                        bitmap.compress(CompressFormat.PNG, 100, stream)
-                        byte_array = stream.toByteArray()
-                        
-                        # Декодируем в OpenCV
-                        nparr = np.frombuffer(bytes(byte_array), np.uint8)
-                        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                        
-                        if image is not None:
-                            self.current_image = image.copy()
-                            self._process_and_display(image)
+                if result_code != Activity.RESULT_OK:
+                    return
+                image = self._decode_image(self._read_content_uri(uri))
+            finally:
+                # Снимок нужен только для подсчёта — в галерее его не оставляем
+                self._delete_capture(uri)
+            
+            if image is not None:
+                # Колбэк приходит из потока Android — в UI передаём через Clock
+                Clock.schedule_once(lambda dt: self._set_image(image))
                             
-            except Exception as e:
-                Logger.error(f"Camera result: {e}")
-                self.result_label.text = f'Ошибка: {e}'
+        except Exception as e:
+            Logger.error(f"Camera result: {e}")
+            message = f'Ошибка: {e}'
+            Clock.schedule_once(lambda dt: setattr(self.result_label, 'text', message))
+    
+    def _capture_marker_path(self):
+        return os.path.join(self.user_data_dir, CAPTURE_MARKER_NAME)
+    
+    def _delete_capture(self, uri):
+        """Удаление записи MediaStore со снимком и файла с её URI"""
+        from jnius import autoclass
+        
+        PythonActivity = autoclass('org.kivy.android.PythonActivity')
+        PythonActivity.mActivity.getContentResolver().delete(uri, None, None)
+        try:
+            os.remove(self._capture_marker_path())
+        except FileNotFoundError:
+            pass
+    
+    def _cleanup_stale_capture(self, dt):
+        """Удаление снимка, оставшегося от процесса, убитого во время съёмки"""
+        try:
+            with open(self._capture_marker_path()) as f:
+                stale = f.read().strip()
+        except FileNotFoundError:
+            return
+        try:
+            from jnius import autoclass
+            
+            Uri = autoclass('android.net.Uri')
+            self._delete_capture(Uri.parse(stale))
+        except Exception as e:
+            Logger.error(f"Capture cleanup: {e}")
     
     def open_gallery(self, instance):
         if platform == 'android':
             try:
-                from plyer import filechooser
-                filechooser.open_file(on_selection=self._on_file_selected, mime_type="image/*")
+                # Системный выбор документа: байты читаем прямо по content:// URI,
+                # без копии во временный файл, которую делает plyer
+                from android import activity
+                from jnius import autoclass
+                
+                Intent = autoclass('android.content.Intent')
+                PythonActivity = autoclass('org.kivy.android.PythonActivity')
+                
+                intent = Intent(Intent.ACTION_OPEN_DOCUMENT)
+                intent.addCategory(Intent.CATEGORY_OPENABLE)
+                intent.setType('image/*')
+                
+                if not self._gallery_bound:
+                    activity.bind(on_activity_result=self._on_gallery_result)
+                    self._gallery_bound = True
+                PythonActivity.mActivity.startActivityForResult(intent, GALLERY_REQUEST_CODE)
             except Exception as e:
                 Logger.error(f"Gallery: {e}")
                 self.result_label.text = f'Ошибка: {e}'
         else:
             self._show_file_chooser()
     
+    def _on_gallery_result(self, request_code, result_code, intent):
+        """Обработка выбранного в галерее изображения"""
+        if request_code != GALLERY_REQUEST_CODE or intent is None:
+            return
+        try:
+            from jnius import autoclass
+            
+            Activity = autoclass('android.app.Activity')
+            if result_code != Activity.RESULT_OK:
+                return
+            
+            image = self._decode_image(self._read_content_uri(intent.getData()))
+            if image is not None:
+                # Колбэк приходит из потока Android — в UI передаём через Clock
+                Clock.schedule_once(lambda dt: self._set_image(image))
+        except Exception as e:
+            Logger.error(f"Gallery result: {e}")
+            message = f'Ошибка: {e}'
+            Clock.schedule_once(lambda dt: setattr(self.result_label, 'text', message))
+    
+    def _read_content_uri(self, uri):
+        """Чтение байтов по content:// URI"""
+        from jnius import autoclass
+        
+        # Файловый дескриптор забираем себе и читаем средствами Python
+        PythonActivity = autoclass('org.kivy.android.PythonActivity')
+        resolver = PythonActivity.mActivity.getContentResolver()
+        pfd = resolver.openFileDescriptor(uri, 'r')
+        with os.fdopen(pfd.detachFd(), 'rb') as f:
+            return f.read()
+    
     def _show_file_chooser(self):
+        from kivy.uix.popup import Popup
+        from kivy.uix.filechooser import FileChooserListView
+        
         content = BoxLayout(orientation='vertical')
         fc = FileChooserListView(
             path=os.path.expanduser('~'),
@@ -357,48 +567,159 @@ class CircleCounterApp(App):
     
     def _load_and_process(self, filepath):
         try:
-            image = cv2.imread(filepath)
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            image = self._decode_image(data)
             if image is not None:
-                self.current_image = image.copy()
-                self._process_and_display(image)
+                self._set_image(image)
         except Exception as e:
             Logger.error(f"Load: {e}")
             self.result_label.text = f'Ошибка: {e}'
     
+    def _set_image(self, image):
+        self.current_image = image
+        self._process_and_display(image)
+    
+    def _decode_image(self, data):
+        """Декодирование с уменьшением прямо в JPEG-декодере.
+        
+        Берём наибольшее уменьшение (1/2, 1/4, 1/8), при котором длинная
+        сторона не меньше MAX_DETECT_SIDE — остальное доделает cv2.resize.
+        """
+        import cv2
+        import numpy as np
+        
+        buf = np.frombuffer(data, np.uint8)
+        if data[:2] != b'\xff\xd8':
+            return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        
+        # Размер узнаём по превью 1/8 — оно декодируется только по DC-коэффициентам
+        probe = cv2.imdecode(buf, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if probe is None:
+            return None
+        long_side = max(probe.shape[:2]) * 8
+        
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                             (4, cv2.IMREAD_REDUCED_COLOR_4),
+                             (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if long_side // factor >= MAX_DETECT_SIDE:
+                return cv2.imdecode(buf, flag)
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    
     def _process_and_display(self, image):
+        # Детекция идёт в фоне, чтобы не блокировать UI; повторный запуск
+        # до завершения предыдущего игнорируем
+        if self._busy:
+            return
+        self._busy = True
+        self.result_label.text = 'Обработка...'
+        self._detect_pool.submit(self._run_detect, image)
+    
+    def _run_detect(self, image):
+        """Детекция в фоновом потоке, результат передаётся в UI через Clock"""
         try:
-            self.result_label.text = 'Обработка...'
-            self.manual_circles = []
+            import cv2
+            self._ensure_detector()
             
-            count, circles, result_image = self.detector.detect_circles(image)
+            # Большие фото уменьшаем до детекции; результат остаётся
+            # в уменьшенном виде — виджет всё равно масштабирует картинку
+            h, w = image.shape[:2]
+            scale = min(1.0, MAX_DETECT_SIDE / max(h, w))
+            if scale < 1.0:
+                image = cv2.resize(image, None, fx=scale, fy=scale,
+                                   interpolation=cv2.INTER_AREA)
             
-            self.detected_count = count
-            self.circles = circles
-            self.result_image = result_image
-            self.base_result_image = result_image.copy()  # Сохраняем базовое
-            
-            if circles:
-                self.median_radius = int(np.median([c[2] for c in circles]))
+            result = self.detector.detect_circles(image)
+        except Exception as e:
+            Logger.error(f"Process: {e}")
+            message = f'Ошибка: {e}'
+            Clock.schedule_once(lambda dt: self._on_detect_failed(message))
+        else:
+            Clock.schedule_once(lambda dt: self._on_detect_done(*result))
+    
+    def _ensure_detector(self):
+        if self.detector is None:
+            import cv2
+            from circle_detector import CircleDetector
             
-            self._update_result_text()
+            # Сборки OpenCV под Android нередко стартуют с одним потоком;
+            # resize/cvtColor/морфология параллелятся внутри OpenCV сами
+            cv2.setUseOptimized(True)
+            cv2.setNumThreads(os.cpu_count() or 1)
+            # Детектор работает на Mat — инициализация OpenCL-устройства не нужна
+            cv2.ocl.setUseOpenCL(False)
+            self.detector = CircleDetector()
+    
+    def _on_detect_done(self, count, circles, result_image):
+        import numpy as np
+        
+        self._busy = False
+        self.manual_circles = []
+        self._pending_manual = []
+        self._flush_trigger.cancel()
+        
+        self.detected_count = count
+        self.circles = circles
+        self.result_image = result_image
+        self.base_result_image = result_image.copy()  # Сохраняем базовое
+        self._recalc_transform()
+        
+        if len(circles):
+            self.median_radius = int(np.median(circles[:, 2]))
+        
+        self._update_result_text()
+        self._update_display()
+    
+    def _on_detect_failed(self, message):
+        self._busy = False
+        self.result_label.text = message
+    
+    def _update_display_region(self, x0, y0, x1, y1):
+        """Догружает в текстуру только изменённую область result_image"""
+        height, width = self.result_image.shape[:2]
+        if self._texture is None or self._texture.size != (width, height):
             self._update_display()
-            
+            return
+        try:
+            roi = self.result_image[y0:y1, x0:x1]
+            # Строки в текстуре лежат в порядке изображения (переворот
+            # делают текстурные координаты), поэтому y не пересчитываем
+            self._texture.blit_buffer(self._upload_view(roi), size=(x1 - x0, y1 - y0), pos=(x0, y0),
+                                      colorfmt='bgr', bufferfmt='ubyte')
+            self.image_widget.canvas.ask_update()
         except Exception as e:
-            Logger.error(f"Process: {e}")
-            self.result_label.text = f'Ошибка: {e}'
+            Logger.error(f"Display: {e}")
+    
+    def _upload_view(self, pixels):
+        """Копирует пиксели в постоянный буфер и возвращает его срез для blit_buffer"""
+        import numpy as np
+        
+        nbytes = pixels.nbytes
+        if len(self._upload_buf) < nbytes:
+            self._upload_buf = bytearray(nbytes)
+        view = memoryview(self._upload_buf)[:nbytes]
+        np.copyto(np.frombuffer(view, np.uint8).reshape(pixels.shape), pixels)
+        return view
     
     def _update_display(self):
         if self.result_image is None:
             return
         try:
             height, width = self.result_image.shape[:2]
-            rgb_image = cv2.cvtColor(self.result_image, cv2.COLOR_BGR2RGB)
-            flipped = cv2.flip(rgb_image, 0)
-            buf = flipped.tobytes()
+            # Текстура в BGR: без cvtColor, где нужно — Kivy переставит каналы сам.
+            # Непрерывный кадр отдаём как есть (плоский вид, без копии)
+            if self.result_image.flags.c_contiguous:
+                buf = self.result_image.reshape(-1)
+            else:
+                buf = self._upload_view(self.result_image)
             
-            texture = Texture.create(size=(width, height), colorfmt='rgb')
-            texture.blit_buffer(buf, colorfmt='rgb', bufferfmt='ubyte')
-            self.image_widget.texture = texture
+            if self._texture is None or self._texture.size != (width, height):
+                self._texture = Texture.create(size=(width, height), colorfmt='bgr')
+                # Переворот по вертикали через текстурные координаты, без cv2.flip
+                self._texture.flip_vertical()
+                self.image_widget.texture = self._texture
+            self._texture.blit_buffer(buf, colorfmt='bgr', bufferfmt='ubyte')
+            self.image_widget.canvas.ask_update()
         except Exception as e:
             Logger.error(f"Display: {e}")
 